@@ -0,0 +1,59 @@
+"""
+In-process TTL cache for expensive results (LLM summaries).
+
+Entries are keyed on a content hash, so a changed repository (new commit →
+different tree / file contents → different context) simply misses; no
+explicit invalidation is needed. Per-process only — each worker keeps
+its own cache.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+def content_key(*parts: str) -> str:
+    """Return a short BLAKE2b hex digest identifying the given strings."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")  # Separator, so ("ab", "c") != ("a", "bc")
+    return digest.hexdigest()
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        """Return the cached value, or None if missing or expired."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store `value`, evicting the least recently used entry when full."""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
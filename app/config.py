@@ -17,11 +17,54 @@ LLM_MODEL: str = "moonshotai/Kimi-K2.5"
 LLM_TEMPERATURE: float = 0.3  # Low temperature for consistent structured output
 LLM_MAX_TOKENS: int = 8192    # Reasoning models need headroom for thinking + answer
 LLM_TIMEOUT: int = 120        # Seconds to wait for LLM response
+LLM_CONTEXT_WINDOW: int = 131_072  # Model context length in tokens; caps max_tokens
+
+# Send the LLMSummary JSON schema as a strict response_format. Turn off for
+# endpoints that reject json_schema; the prompt still asks for bare JSON.
+LLM_STRUCTURED_OUTPUT: bool = True
+
+# When True the answer is parsed leniently (markdown fences, surrounding
+# prose) for models/endpoints that ignore response_format; False requires
+# bare JSON.
+LLM_LENIENT_JSON: bool = True
+
+# Summaries are cached per (model, prompt, context) — identical requests
+# within the TTL skip the LLM call. Set either to 0 to disable.
+LLM_CACHE_TTL: int = 3600     # Seconds
+LLM_CACHE_SIZE: int = 256     # Entries
+
+# Concurrent requests for the same context share one in-flight LLM call
+LLM_COALESCE_REQUESTS: bool = True
+
+# Summaries per (owner, repo, root tree SHA): an unchanged repository is
+# answered without fetching files or calling the LLM. 0 disables.
+RESPONSE_CACHE_TTL: int = 3600  # Seconds
+RESPONSE_CACHE_SIZE: int = 1024  # Entries
+
+# ── CORS ──────────────────────────────────────────────────────────────
+# Comma-separated allowed origins; "*" allows any origin (without
+# credentials), an empty value disables the CORS middleware entirely.
+CORS_ORIGINS: list[str] = [
+    origin.strip()
+    for origin in os.environ.get("CORS_ORIGINS", "*").split(",")
+    if origin.strip()
+]
 
 # ── GitHub API ────────────────────────────────────────────────────────
 GITHUB_TOKEN: str | None = os.environ.get("GITHUB_TOKEN")  # Optional, for higher rate limits
 GITHUB_API_BASE: str = "https://api.github.com"
+GITHUB_GRAPHQL_URL: str = "https://api.github.com/graphql"  # Requires GITHUB_TOKEN
 GITHUB_REQUEST_TIMEOUT: int = 30  # Seconds per GitHub API request
+GITHUB_CONNECT_RETRIES: int = 2  # Transport-level retries on failed connects
+# API responses kept for If-None-Match, bounded by entry count and by their
+# total size on the wire (parsed JSON takes several times more memory).
+# Responses bigger than the byte cap on their own are never cached.
+GITHUB_ETAG_CACHE_SIZE: int = 256  # Entries
+GITHUB_ETAG_CACHE_BYTES: int = 16 * 1024 * 1024  # Response bytes
+
+# Files fetched per GraphQL query (one aliased `object` field each).
+# GitHub caps a query at ~500 nodes, so stay well below that.
+GITHUB_GRAPHQL_BATCH_SIZE: int = 200
 
 # ── Content Filtering ────────────────────────────────────────────────
 # Approximate character budget for the LLM context window.
@@ -37,3 +80,7 @@ MAX_FILE_LINES: int = 300
 
 # Max individual file size (bytes) to even attempt fetching
 MAX_FILE_SIZE_BYTES: int = 512_000  # 500 KB
+
+# Paths remembered by the skip/tier caches — sized to survive across
+# requests in a long-running server, where filenames repeat heavily
+FILTER_CACHE_SIZE: int = 65_536
@@ -10,14 +10,30 @@ The goal is to give the LLM the *best possible understanding* of the project
 while staying well within the context window.
 """
 
-import os
-from app.config import MAX_CONTEXT_CHARS, MAX_TREE_LINES, MAX_FILE_LINES
+import bisect
+import itertools
+import re
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
+
+from app.config import (
+    FILTER_CACHE_SIZE,
+    MAX_CONTEXT_CHARS,
+    MAX_FILE_LINES,
+    MAX_FILE_SIZE_BYTES,
+    MAX_TREE_LINES,
+)
+
+try:
+    import ahocorasick
+except ImportError:  # Optional C extension — fall back to a regex union
+    ahocorasick = None
 
 
 # ── Skip Rules ────────────────────────────────────────────────────────
 
 # Directories to always skip entirely
-SKIP_DIRS: set[str] = {
+SKIP_DIRS: frozenset[str] = frozenset({
     "node_modules",
     "vendor",
     "dist",
@@ -50,10 +66,10 @@ SKIP_DIRS: set[str] = {
     "out",             # Common build output
     "bin",             # Compiled binaries
     "obj",             # .NET build intermediate
-}
+})
 
 # File extensions to always skip (binary / non-informative)
-SKIP_EXTENSIONS: set[str] = {
+SKIP_EXTENSIONS: frozenset[str] = frozenset({
     # Images
     ".png", ".jpg", ".jpeg", ".gif", ".ico", ".svg", ".bmp", ".webp", ".tiff",
     # Fonts
@@ -71,37 +87,37 @@ SKIP_EXTENSIONS: set[str] = {
     # Maps / minified
     ".map", ".min.js", ".min.css",
     # Misc
-    ".DS_Store", ".lock",
-}
+    ".ds_store", ".lock",
+})
 
 # Exact filenames to always skip
-SKIP_FILES: set[str] = {
+SKIP_FILES: frozenset[str] = frozenset({
     "package-lock.json",
     "yarn.lock",
     "pnpm-lock.yaml",
-    "Pipfile.lock",
+    "pipfile.lock",
     "poetry.lock",
-    "Cargo.lock",
+    "cargo.lock",
     "composer.lock",
-    "Gemfile.lock",
+    "gemfile.lock",
     "go.sum",
     "flake.lock",
     ".gitattributes",
     ".editorconfig",
     ".browserslistrc",
     "thumbs.db",
-}
+})
 
 
 # ── Priority Tiers ────────────────────────────────────────────────────
 
 # Tier 1: Project overview (always include)
-TIER_1_FILES: set[str] = {
+TIER_1_FILES: frozenset[str] = frozenset({
     "readme.md", "readme.rst", "readme.txt", "readme",
-}
+})
 
 # Tier 2: Package manifests (technologies & dependencies)
-TIER_2_FILES: set[str] = {
+TIER_2_FILES: frozenset[str] = frozenset({
     "package.json",
     "pyproject.toml",
     "setup.py",
@@ -120,10 +136,10 @@ TIER_2_FILES: set[str] = {
     "requirements_dev.txt",
     "pipfile",
     "environment.yml",
-}
+})
 
 # Tier 3: Config / infrastructure files (architecture & tooling)
-TIER_3_FILES: set[str] = {
+TIER_3_FILES: frozenset[str] = frozenset({
     "dockerfile",
     "docker-compose.yml",
     "docker-compose.yaml",
@@ -156,16 +172,16 @@ TIER_3_FILES: set[str] = {
     "cdk.json",
     "terraform.tf",
     "ansible.cfg",
-}
+})
 
 # Tier 4: Source code entry points (core logic)
-TIER_4_BASENAMES: set[str] = {
+TIER_4_BASENAMES: frozenset[str] = frozenset({
     "main", "app", "index", "server", "cli", "run", "manage",
     "__main__", "wsgi", "asgi",
-}
+})
 
 # Source code extensions for Tier 4/5
-SOURCE_EXTENSIONS: set[str] = {
+SOURCE_EXTENSIONS: frozenset[str] = frozenset({
     ".py", ".js", ".ts", ".jsx", ".tsx",
     ".go", ".rs", ".rb", ".java", ".kt",
     ".c", ".cpp", ".h", ".hpp", ".cs",
@@ -174,10 +190,10 @@ SOURCE_EXTENSIONS: set[str] = {
     ".sh", ".bash", ".zsh", ".fish",
     ".sql", ".graphql", ".gql",
     ".proto",
-}
+})
 
 # Tier 6: Supplementary docs (low priority)
-TIER_6_FILES: set[str] = {
+TIER_6_FILES: frozenset[str] = frozenset({
     "contributing.md",
     "changelog.md",
     "changes.md",
@@ -189,68 +205,162 @@ TIER_6_FILES: set[str] = {
     "license.md",
     "license.txt",
     "notice",
+})
+
+
+# ── Skip Matcher ─────────────────────────────────────────────────────
+
+
+def _build_skip_automaton():
+    """
+    Compile every skip rule into one Aho-Corasick automaton.
+
+    Matched against "/" + lowercased path + "\\0", so that:
+      - "/<dir>/"   hits any directory segment in SKIP_DIRS
+      - "/<file>\\0" hits a filename in SKIP_FILES
+      - "<ext>\\0"   hits a filename ending in one of SKIP_EXTENSIONS
+
+    Returns None when pyahocorasick isn't installed.
+    """
+    if ahocorasick is None:
+        return None
+
+    automaton = ahocorasick.Automaton()
+    patterns = (
+        [f"/{d}/" for d in SKIP_DIRS]
+        + [f"/{f}\0" for f in SKIP_FILES]
+        + [f"{ext}\0" for ext in SKIP_EXTENSIONS]
+    )
+    for pattern in patterns:
+        automaton.add_word(pattern, pattern)
+    automaton.make_automaton()
+    return automaton
+
+
+_SKIP_AUTOMATON = _build_skip_automaton()
+
+
+def _alternation(words) -> str:
+    """Regex alternation of literal words, longest first."""
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+# The same rules as one regex over the same "/path\0" framing, for when
+# pyahocorasick is missing — a single C-level search per path
+_SKIP_RE = re.compile(
+    f"/(?:(?:{_alternation(SKIP_DIRS)})/|(?:{_alternation(SKIP_FILES)})\0)"
+    f"|(?:{_alternation(SKIP_EXTENSIONS)})\0"
+)
+
+
+# ── Tier Lookup Tables ───────────────────────────────────────────────
+
+# Exact filename → tier, merged so one hash probe replaces the cascade
+_TIER_BY_FILE: dict[str, int] = {
+    **{f: 6 for f in TIER_6_FILES},
+    **{f: 3 for f in TIER_3_FILES},
+    **{f: 2 for f in TIER_2_FILES},
+    **{f: 1 for f in TIER_1_FILES},
 }
 
+# Extension → tier for source files that aren't entry points
+_TIER_BY_EXT: dict[str, int] = {ext: 5 for ext in SOURCE_EXTENSIONS}
+
 
 # ── Filtering Logic ──────────────────────────────────────────────────
 
 
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
 def _should_skip(path: str) -> bool:
     """Return True if this file/dir path should be excluded from context."""
-    parts = path.lower().split("/")
+    # One linear scan over the whole path instead of per-segment lookups
+    key = f"/{path.lower()}\0"
+    if _SKIP_AUTOMATON is not None:
+        return next(_SKIP_AUTOMATON.iter(key), None) is not None
+    return _SKIP_RE.search(key) is not None
+
 
-    # Skip if any path segment matches a skipped directory
-    for part in parts[:-1]:  # Check directory segments, not the filename
-        if part in SKIP_DIRS:
-            return True
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _get_tier(path: str) -> int:
+    """
+    Assign a priority tier (1=highest, 6=lowest, 99=skip) to a file.
+    Lower tier = more important = fetched first.
+    """
+    dirname, _, filename = path.rpartition("/")
+    filename = filename.lower()
 
-    filename = parts[-1]
-    _, ext = os.path.splitext(filename)
+    # Tiers 1–3 and 6: known filenames
+    tier = _TIER_BY_FILE.get(filename)
+    if tier:
+        return tier
 
-    # Skip by exact filename
-    if filename in SKIP_FILES:
-        return True
+    dot = filename.rfind(".")
+    if dot <= 0:  # No extension (or a dotfile) — not source code
+        return 99
+    ext = filename[dot:]
 
-    # Skip by extension
-    if ext in SKIP_EXTENSIONS:
-        return True
+    if ext in SOURCE_EXTENSIONS:
+        # Tier 4: Entry point source files
+        if filename[:dot] in TIER_4_BASENAMES:
+            return 4
 
-    return False
+        # Tier 4 bonus: root-level __init__.py (package overview)
+        if filename == "__init__.py" and not dirname:
+            return 4
 
+    # Tier 5: Other source files — everything else: skip for LLM context
+    return _TIER_BY_EXT.get(ext, 99)
 
-def _get_tier(path: str, size: int) -> int:
+
+def clear_filter_caches() -> None:
     """
-    Assign a priority tier (1=highest, 6=lowest, 99=skip) to a file.
-    Lower tier = more important = fetched first.
+    Reset the memoized skip/tier results — only needed between tests.
+
+    The matchers (_SKIP_AUTOMATON / _SKIP_RE, _TIER_BY_*) are built from the
+    SKIP_* and TIER_* sets at import, so patching those sets has no effect
+    even after clearing; patch the built matchers instead.
     """
-    filename = os.path.basename(path).lower()
-    basename_no_ext, ext = os.path.splitext(filename)
+    _should_skip.cache_clear()
+    _get_tier.cache_clear()
 
-    if filename in TIER_1_FILES:
-        return 1
-    if filename in TIER_2_FILES:
-        return 2
-    if filename in TIER_3_FILES:
-        return 3
 
-    # Tier 4: Entry point source files
-    if basename_no_ext in TIER_4_BASENAMES and ext in SOURCE_EXTENSIONS:
-        return 4
+def _iter_unskipped(tree: list[dict]) -> Iterator[dict]:
+    """
+    Yield the tree entries that survive the skip rules.
 
-    # Tier 4 bonus: root-level __init__.py (package overview)
-    if filename == "__init__.py" and "/" not in path:
-        return 4
+    GitHub lists the recursive tree depth-first, so a skipped directory's
+    contents (e.g. node_modules/...) follow it contiguously: remembering
+    only the most recent skipped prefix rejects them with one str.startswith
+    each. Entries that arrive out of order still fall through to _should_skip.
+    """
+    skip_prefix: str | None = None
 
-    # Tier 5: Other source files
-    if ext in SOURCE_EXTENSIONS:
-        return 5
+    for item in tree:
+        path = item["path"]
+        if skip_prefix is not None:
+            if path.startswith(skip_prefix):
+                continue
+            skip_prefix = None
+
+        if item["type"] == "tree" and path.rpartition("/")[2].lower() in SKIP_DIRS:
+            skip_prefix = f"{path}/"
+
+        if _should_skip(path):
+            continue
 
-    # Tier 6: Supplementary docs
-    if filename in TIER_6_FILES:
-        return 6
+        yield item
 
-    # Everything else: skip for LLM context
-    return 99
+
+def process_tree(tree: list[dict]) -> tuple[str, list[dict]]:
+    """
+    Format the directory tree and select files for context.
+
+    Returns (tree_string, selected_files) — the same results as
+    format_tree() and select_files(), but the skip rules run only once
+    per tree entry.
+    """
+    kept = list(_iter_unskipped(tree))
+    return _format_entries(kept, len(tree)), _select_entries(kept)
 
 
 def select_files(tree: list[dict]) -> list[dict]:
@@ -258,21 +368,26 @@ def select_files(tree: list[dict]) -> list[dict]:
     Filter and prioritise files from the repository tree.
 
     Returns a list of file entries sorted by priority tier, then by path.
-    Each entry has keys: path, size, tier.
+    Each entry has keys: path, size, tier, sha (None if the tree lacks it).
     """
+    return _select_entries(_iter_unskipped(tree))
+
+
+def _select_entries(entries: Iterable[dict]) -> list[dict]:
+    """Tier and sort the fetchable files among already-unskipped entries."""
     candidates = []
 
-    for item in tree:
+    for item in entries:
         if item["type"] != "blob":
             continue
 
-        path = item["path"]
+        # Too large to fetch — don't spend a request finding that out
         size = item.get("size", 0)
-
-        if _should_skip(path):
+        if size > MAX_FILE_SIZE_BYTES:
             continue
 
-        tier = _get_tier(path, size)
+        path = item["path"]
+        tier = _get_tier(path)
         if tier == 99:
             continue
 
@@ -280,6 +395,7 @@ def select_files(tree: list[dict]) -> list[dict]:
             "path": path,
             "size": size,
             "tier": tier,
+            "sha": item.get("sha"),
         })
 
     # Sort by tier (ascending), then alphabetically within each tier
@@ -296,42 +412,33 @@ def format_tree(tree: list[dict]) -> str:
 
     Skips entries inside ignored directories and truncates if too long.
     """
-    lines: list[str] = []
+    return _format_entries(_iter_unskipped(tree), len(tree))
 
-    for item in tree:
-        path = item["path"]
 
-        # Skip entries inside ignored directories
-        parts = path.split("/")
-        if any(p.lower() in SKIP_DIRS for p in parts[:-1]):
-            continue
+def _format_entries(entries: Iterable[dict], total: int) -> str:
+    """Format already-unskipped entries, stopping after MAX_TREE_LINES."""
+    lines = [
+        _format_tree_line(item)
+        for item in itertools.islice(entries, MAX_TREE_LINES)
+    ]
+    if len(lines) >= MAX_TREE_LINES:
+        lines.append(f"  ... (truncated, {total} total entries)")
+    return "\n".join(lines)
 
-        # Skip binary / noise files in the tree view too
-        filename = parts[-1].lower()
-        _, ext = os.path.splitext(filename)
-        if ext in SKIP_EXTENSIONS or filename in SKIP_FILES:
-            continue
 
-        # Indent based on depth
-        depth = len(parts) - 1
-        prefix = "  " * depth
-        name = parts[-1]
-
-        if item["type"] == "tree":
-            lines.append(f"{prefix}{name}/")
-        else:
-            size = item.get("size", 0)
-            if size > 0:
-                size_str = _format_size(size)
-                lines.append(f"{prefix}{name}  ({size_str})")
-            else:
-                lines.append(f"{prefix}{name}")
-
-        if len(lines) >= MAX_TREE_LINES:
-            lines.append(f"  ... (truncated, {len(tree)} total entries)")
-            break
+def _format_tree_line(item: dict) -> str:
+    """Format one tree entry, indented by depth, with its size if known."""
+    parts = item["path"].split("/")
+    prefix = "  " * (len(parts) - 1)
+    name = parts[-1]
 
-    return "\n".join(lines)
+    if item["type"] == "tree":
+        return f"{prefix}{name}/"
+
+    size = item.get("size", 0)
+    if size > 0:
+        return f"{prefix}{name}  ({_format_size(size)})"
+    return f"{prefix}{name}"
 
 
 def _format_size(size_bytes: int) -> str:
@@ -346,14 +453,21 @@ def _format_size(size_bytes: int) -> str:
 
 # ── Context Building ─────────────────────────────────────────────────
 
+# Most a file block can add beyond its path and raw content: the
+# "--- path ---" framing plus truncate_file_content's trailing note
+_BLOCK_OVERHEAD_MAX = 80
+
 
 def truncate_file_content(content: str, max_lines: int = MAX_FILE_LINES) -> str:
     """Truncate file content to a maximum number of lines."""
-    lines = content.split("\n")
-    if len(lines) <= max_lines:
+    newlines = content.count("\n")
+    if newlines < max_lines:
         return content
-    truncated = "\n".join(lines[:max_lines])
-    truncated += f"\n\n... (truncated, {len(lines)} total lines)"
+    # Only the remainder after the last kept line matters; its length gives
+    # the cut offset, so the kept lines never need re-joining
+    rest = content.split("\n", max_lines)[-1]
+    truncated = content[: len(content) - len(rest) - 1]
+    truncated += f"\n\n... (truncated, {newlines + 1} total lines)"
     return truncated
 
 
@@ -362,13 +476,14 @@ def build_context(
     tree: list[dict],
     file_contents: dict[str, str],
     selected_files: list[dict],
+    tree_str: str | None = None,
 ) -> str:
     """
     Build the final context string to send to the LLM.
 
     Structure:
       1. Repository metadata
-      2. Directory tree
+      2. Directory tree (`tree_str` if already built by process_tree)
       3. File contents (in priority order, within budget)
 
     Returns the context string, staying within MAX_CONTEXT_CHARS.
@@ -382,7 +497,8 @@ def build_context(
     total_chars += len(meta_section)
 
     # ── Section 2: Directory tree ─────────────────────────────────────
-    tree_str = format_tree(tree)
+    if tree_str is None:
+        tree_str = format_tree(tree)
     tree_section = f"=== DIRECTORY STRUCTURE ===\n{tree_str}\n"
     sections.append(tree_section)
     total_chars += len(tree_section)
@@ -392,19 +508,26 @@ def build_context(
     sections.append(file_section_header)
     total_chars += len(file_section_header)
 
-    for file_info in selected_files:
-        path = file_info["path"]
-        if path not in file_contents:
-            continue
+    fetched = [f for f in selected_files if f["path"] in file_contents]
+
+    # Prefix sums of each block's upper bound, bisected against the budget,
+    # give how many files are guaranteed to fit without rendering them first
+    bounds = itertools.accumulate(
+        len(f["path"]) + len(file_contents[f["path"]]) + _BLOCK_OVERHEAD_MAX
+        for f in fetched
+    )
+    guaranteed = bisect.bisect_right(list(bounds), MAX_CONTEXT_CHARS - total_chars)
 
-        content = file_contents[path]
-        content = truncate_file_content(content)
+    files_added = 0
+    for index, file_info in enumerate(fetched):
+        path = file_info["path"]
+        content = truncate_file_content(file_contents[path])
 
         file_block = f"--- {path} ---\n{content}\n\n"
         block_len = len(file_block)
 
-        # Check budget before adding
-        if total_chars + block_len > MAX_CONTEXT_CHARS:
+        # Check budget before adding — only needed past the guaranteed prefix
+        if index >= guaranteed and total_chars + block_len > MAX_CONTEXT_CHARS:
             # For high-priority files (tier 1–3), try harder: truncate more
             if file_info["tier"] <= 3:
                 available = MAX_CONTEXT_CHARS - total_chars - 200  # Leave room for header
@@ -413,11 +536,9 @@ def build_context(
                     file_block = f"--- {path} (truncated to fit budget) ---\n{content}\n\n"
                     sections.append(file_block)
                     total_chars += len(file_block)
+                    files_added += 1
             # For lower-priority files, just stop
-            remaining = sum(
-                1 for f in selected_files
-                if f["path"] in file_contents and f["path"] != path
-            )
+            remaining = len(fetched) - files_added
             sections.append(
                 f"... ({remaining} additional files omitted due to context budget)\n"
             )
@@ -425,6 +546,7 @@ def build_context(
 
         sections.append(file_block)
         total_chars += block_len
+        files_added += 1
 
     return "\n".join(sections)
 
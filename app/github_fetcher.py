@@ -1,22 +1,45 @@
 """
 GitHub API interaction — fetch repository metadata, file tree, and file contents.
 
-Uses the GitHub REST API (v3) with optional token authentication.
+Uses the GitHub REST API (v3) with optional token authentication. When a
+token is configured, file contents are fetched in bulk via the GraphQL API
+(which requires auth) instead of one request per file.
 All functions are async and use httpx for HTTP requests.
 """
 
+import asyncio
+import base64
+import json
+import logging
 import re
+from collections import OrderedDict
 from urllib.parse import urlparse
 
 import httpx
 
 from app.config import (
     GITHUB_API_BASE,
+    GITHUB_CONNECT_RETRIES,
+    GITHUB_ETAG_CACHE_BYTES,
+    GITHUB_ETAG_CACHE_SIZE,
+    GITHUB_GRAPHQL_BATCH_SIZE,
+    GITHUB_GRAPHQL_URL,
     GITHUB_REQUEST_TIMEOUT,
     GITHUB_TOKEN,
     MAX_FILE_SIZE_BYTES,
 )
 
+try:
+    import orjson
+except ImportError:  # Optional C extension — fall back to the stdlib parser
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Recursive tree listings of large repos run to several MB; orjson parses
+# the raw body bytes directly, skipping httpx's intermediate text decode
+_json_loads = orjson.loads if orjson is not None else json.loads
+
 
 class GitHubFetchError(Exception):
     """Raised when a GitHub API request fails."""
@@ -29,6 +52,8 @@ class GitHubFetchError(Exception):
 
 # ── URL Parsing ───────────────────────────────────────────────────────
 
+_NAME_RE = re.compile(r"^[\w.\-]+$")
+
 
 def parse_github_url(url: str) -> tuple[str, str]:
     """
@@ -66,8 +91,7 @@ def parse_github_url(url: str) -> tuple[str, str]:
     owner, repo = parts[0], parts[1]
 
     # Basic sanity check on owner/repo names
-    name_pattern = re.compile(r"^[\w.\-]+$")
-    if not name_pattern.match(owner) or not name_pattern.match(repo):
+    if not _NAME_RE.match(owner) or not _NAME_RE.match(repo):
         raise GitHubFetchError(
             f"Invalid owner or repo name: {owner}/{repo}",
             status_code=400,
@@ -79,29 +103,88 @@ def parse_github_url(url: str) -> tuple[str, str]:
 # ── HTTP Client Helpers ───────────────────────────────────────────────
 
 
-def _build_headers() -> dict[str, str]:
-    """Build request headers, including auth token if available."""
-    headers = {
-        "Accept": "application/vnd.github.v3+json",
-        "User-Agent": "github-repo-summarizer/1.0",
-    }
-    if GITHUB_TOKEN:
-        headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
-    return headers
+# Request headers, including auth token if available
+_HEADERS: dict[str, str] = {
+    "Accept": "application/vnd.github.v3+json",
+    "User-Agent": "github-repo-summarizer/1.0",
+    **({"Authorization": f"Bearer {GITHUB_TOKEN}"} if GITHUB_TOKEN else {}),
+}
+
+
+# Shared across requests so connections (and their TLS sessions) are
+# reused; HTTP/2 multiplexes concurrent file fetches over one connection.
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared GitHub HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        # http2/limits must live on the transport: an AsyncClient given an
+        # explicit transport ignores its own. Retries only cover connection
+        # failures (refused/reset before a response), never HTTP 5xx.
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            retries=GITHUB_CONNECT_RETRIES,
+        )
+        _client = httpx.AsyncClient(transport=transport, headers=_HEADERS)
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared GitHub HTTP client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
+# LRU of endpoint → (etag, json, response size in bytes). Repeat requests
+# are sent with If-None-Match; a 304 reply carries no body, and on
+# authenticated requests it also doesn't count against the rate limit
+# (anonymous 304s still do). _etag_cache_bytes tracks the summed sizes
+# for the byte cap.
+_ETAG_CACHE: OrderedDict[str, tuple[str, dict, int]] = OrderedDict()
+_etag_cache_bytes = 0
 
-async def _github_get(client: httpx.AsyncClient, endpoint: str) -> dict:
+
+def _etag_cache_put(endpoint: str, etag: str, data: dict, size: int) -> None:
+    """Cache a response, evicting least recently used entries past either cap."""
+    global _etag_cache_bytes
+    if size > GITHUB_ETAG_CACHE_BYTES:
+        return
+
+    old = _ETAG_CACHE.pop(endpoint, None)
+    if old is not None:
+        _etag_cache_bytes -= old[2]
+    _ETAG_CACHE[endpoint] = (etag, data, size)
+    _etag_cache_bytes += size
+
+    while (
+        len(_ETAG_CACHE) > GITHUB_ETAG_CACHE_SIZE
+        or _etag_cache_bytes > GITHUB_ETAG_CACHE_BYTES
+    ):
+        _etag_cache_bytes -= _ETAG_CACHE.popitem(last=False)[1][2]
+
+
+async def _github_get(
+    client: httpx.AsyncClient, endpoint: str, use_etag_cache: bool = True
+) -> dict:
     """
     Perform a GET request against the GitHub API.
 
+    Responses carrying an ETag are cached (unless `use_etag_cache` is False)
+    and revalidated on the next request for the same endpoint.
+
     Raises GitHubFetchError with appropriate status codes on failure.
     """
     url = f"{GITHUB_API_BASE}{endpoint}"
+    cached = _ETAG_CACHE.get(endpoint) if use_etag_cache else None
+    headers = {"If-None-Match": cached[0]} if cached else None
     try:
         response = await client.get(
-            url,
-            headers=_build_headers(),
-            timeout=GITHUB_REQUEST_TIMEOUT,
+            url, headers=headers, timeout=GITHUB_REQUEST_TIMEOUT
         )
     except httpx.TimeoutException:
         raise GitHubFetchError(
@@ -114,6 +197,9 @@ async def _github_get(client: httpx.AsyncClient, endpoint: str) -> dict:
             status_code=502,
         )
 
+    if response.status_code == 304 and cached:
+        _ETAG_CACHE.move_to_end(endpoint)
+        return cached[1]
     if response.status_code == 404:
         raise GitHubFetchError(
             "Repository not found. Make sure the URL points to a public repository.",
@@ -131,7 +217,94 @@ async def _github_get(client: httpx.AsyncClient, endpoint: str) -> dict:
             status_code=response.status_code,
         )
 
-    return response.json()
+    data = _json_loads(response.content)
+    etag = response.headers.get("etag")
+    if use_etag_cache and etag:
+        _etag_cache_put(endpoint, etag, data, len(response.content))
+    return data
+
+
+async def _github_graphql(
+    client: httpx.AsyncClient, query: str, variables: dict
+) -> dict:
+    """
+    Run a query against the GitHub GraphQL API and return its `data` object.
+
+    Raises GitHubFetchError on transport errors, non-200 responses, or a
+    response without data.
+    """
+    try:
+        response = await client.post(
+            GITHUB_GRAPHQL_URL,
+            json={"query": query, "variables": variables},
+            timeout=GITHUB_REQUEST_TIMEOUT,
+        )
+    except httpx.TimeoutException:
+        raise GitHubFetchError(
+            "GitHub GraphQL request timed out. Please try again.",
+            status_code=504,
+        )
+    except httpx.RequestError as exc:
+        raise GitHubFetchError(
+            f"Network error while contacting GitHub: {exc}",
+            status_code=502,
+        )
+
+    if response.status_code != 200:
+        raise GitHubFetchError(
+            f"GitHub GraphQL API returned status {response.status_code}.",
+            status_code=response.status_code,
+        )
+
+    payload = _json_loads(response.content)
+    if not payload.get("data"):
+        errors = payload.get("errors") or [{}]
+        raise GitHubFetchError(
+            f"GitHub GraphQL query failed: {errors[0].get('message', 'no data')}",
+            status_code=502,
+        )
+    return payload["data"]
+
+
+def _build_blobs_query(count: int) -> str:
+    """
+    Build a GraphQL query fetching `count` blobs as aliased fields f0..fN.
+
+    Each alias takes its `branch:path` expression from variable $pN, so
+    paths never need escaping.
+    """
+    params = "".join(f", $p{i}: String!" for i in range(count))
+    fields = "\n".join(
+        f"    f{i}: object(expression: $p{i}) "
+        "{ ... on Blob { isBinary isTruncated byteSize text } }"
+        for i in range(count)
+    )
+    return (
+        f"query($owner: String!, $name: String!{params}) {{\n"
+        f"  repository(owner: $owner, name: $name) {{\n{fields}\n  }}\n}}"
+    )
+
+
+def _decode_text(raw: bytes | bytearray) -> str | None:
+    """
+    Decode fetched file bytes as UTF-8 text.
+
+    Returns None for files that are too large, look binary, or aren't
+    valid UTF-8. The binary sniff runs on the raw bytes (a C-level memchr)
+    so binary files never pay for a full decode.
+    """
+    # Skip files that are too large
+    if len(raw) > MAX_FILE_SIZE_BYTES:
+        return None
+
+    # Quick binary content check (null bytes are a giveaway)
+    if raw.find(b"\x00", 0, 8192) != -1:
+        return None
+
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
 
 
 # ── Public API ────────────────────────────────────────────────────────
@@ -160,14 +333,14 @@ async def fetch_repo_metadata(
     }
 
 
-async def fetch_file_tree(
+async def _fetch_tree(
     client: httpx.AsyncClient, owner: str, repo: str, branch: str
-) -> list[dict]:
+) -> tuple[str | None, list[dict]]:
     """
-    Fetch the full recursive file tree for the repository.
+    Fetch the full recursive file tree, keeping the root tree SHA alongside it.
 
-    Returns a list of dicts, each with keys:
-      path, type ("blob" or "tree"), size (bytes, only for blobs)
+    Returns (tree_sha, tree_list), where each tree entry is a dict with keys:
+      path, type ("blob" or "tree"), size (bytes, 0 for directories), sha
     """
     data = await _github_get(
         client, f"/repos/{owner}/{repo}/git/trees/{branch}?recursive=1"
@@ -177,17 +350,17 @@ async def fetch_file_tree(
         # GitHub truncates trees with >100K entries — still usable, just incomplete
         pass
 
-    tree = []
-    for item in data.get("tree", []):
-        entry = {
+    # One fixed-shape dict per entry — no per-item branching on the type
+    tree = [
+        {
             "path": item["path"],
             "type": item["type"],  # "blob" or "tree"
+            "size": item.get("size", 0),
+            "sha": item.get("sha"),
         }
-        if item["type"] == "blob":
-            entry["size"] = item.get("size", 0)
-        tree.append(entry)
-
-    return tree
+        for item in data.get("tree", [])
+    ]
+    return data.get("sha"), tree
 
 
 async def fetch_file_content(
@@ -202,79 +375,180 @@ async def fetch_file_content(
     raw_url = f"https://raw.githubusercontent.com/{owner}/{repo}/{branch}/{file_path}"
 
     try:
-        response = await client.get(
+        async with client.stream(
+            "GET",
             raw_url,
             timeout=GITHUB_REQUEST_TIMEOUT,
-            headers={"User-Agent": "github-repo-summarizer/1.0"},
             follow_redirects=True,
-        )
+        ) as response:
+            if response.status_code != 200:
+                return None
+
+            # Skip files that are too large — abort the download as soon as
+            # the cap is crossed rather than trusting Content-Length alone
+            content_length = response.headers.get("content-length")
+            if content_length and int(content_length) > MAX_FILE_SIZE_BYTES:
+                return None
+
+            body = bytearray()
+            async for chunk in response.aiter_bytes(65536):
+                body.extend(chunk)
+                if len(body) > MAX_FILE_SIZE_BYTES:
+                    return None
     except (httpx.TimeoutException, httpx.RequestError):
         return None
 
-    if response.status_code != 200:
-        return None
+    return _decode_text(body)
 
-    # Skip files that are too large
-    content_length = response.headers.get("content-length")
-    if content_length and int(content_length) > MAX_FILE_SIZE_BYTES:
-        return None
 
-    # Try to decode as text — skip binary files
+async def fetch_blob(
+    client: httpx.AsyncClient, owner: str, repo: str, sha: str
+) -> str | None:
+    """
+    Fetch a file's content by blob SHA via the Git Blobs API.
+
+    Served from the API host, so it shares the pooled connection with the
+    other API calls. Returns the content as a string, or None if the blob
+    is too large, binary, or cannot be fetched.
+    """
+    # Blobs are immutable and can be large — not worth an ETag cache slot
+    endpoint = f"/repos/{owner}/{repo}/git/blobs/{sha}"
     try:
-        text = response.text
-    except (UnicodeDecodeError, ValueError):
+        data = await _github_get(client, endpoint, use_etag_cache=False)
+    except GitHubFetchError:
         return None
 
-    # Quick binary content check (null bytes are a giveaway)
-    if "\x00" in text[:8192]:
+    if data.get("size", 0) > MAX_FILE_SIZE_BYTES:
+        return None
+    if data.get("encoding") != "base64":
         return None
 
-    return text
+    try:
+        raw = base64.b64decode(data.get("content", ""))
+    except ValueError:
+        return None
+
+    return _decode_text(raw)
 
 
 async def fetch_repo_data(
-    owner: str, repo: str
+    owner: str, repo: str, client: httpx.AsyncClient | None = None
 ) -> tuple[dict, list[dict]]:
     """
     High-level convenience function: fetch repo metadata + file tree.
 
-    Returns (metadata_dict, tree_list).
+    Both requests run concurrently — the tree is fetched at HEAD, which
+    GitHub resolves to the default branch, so it doesn't wait on metadata.
+    Uses the shared client unless one is passed in.
+
+    Returns (metadata_dict, tree_list); the metadata also carries
+    `tree_sha`, the root tree SHA, which changes with the repo's contents.
     """
-    async with httpx.AsyncClient() as client:
-        metadata = await fetch_repo_metadata(client, owner, repo)
-        tree = await fetch_file_tree(
-            client, owner, repo, metadata["default_branch"]
-        )
+    client = client or get_client()
+    metadata, (tree_sha, tree) = await asyncio.gather(
+        fetch_repo_metadata(client, owner, repo),
+        _fetch_tree(client, owner, repo, "HEAD"),
+    )
+    metadata["tree_sha"] = tree_sha
     return metadata, tree
 
 
+async def fetch_files_graphql(
+    client: httpx.AsyncClient,
+    owner: str,
+    repo: str,
+    branch: str,
+    file_paths: list[str],
+) -> dict[str, str]:
+    """
+    Fetch content for multiple files via the GraphQL API.
+
+    Paths are split into queries of GITHUB_GRAPHQL_BATCH_SIZE aliased blobs,
+    which run concurrently — one round trip (and one rate-limit point) per
+    query instead of one per file. Requires GITHUB_TOKEN.
+
+    Returns a dict mapping file_path → content, skipping binary, truncated,
+    oversized, and missing files. Raises GitHubFetchError if any query fails.
+    """
+    batches = [
+        file_paths[i : i + GITHUB_GRAPHQL_BATCH_SIZE]
+        for i in range(0, len(file_paths), GITHUB_GRAPHQL_BATCH_SIZE)
+    ]
+
+    async def run_batch(batch: list[str]) -> dict:
+        variables = {"owner": owner, "name": repo}
+        for i, fp in enumerate(batch):
+            variables[f"p{i}"] = f"{branch}:{fp}"
+        query = _build_blobs_query(len(batch))
+        data = await _github_graphql(client, query, variables)
+        return data.get("repository") or {}
+
+    responses = await asyncio.gather(*(run_batch(b) for b in batches))
+
+    results: dict[str, str] = {}
+    for batch, blobs in zip(batches, responses):
+        for i, fp in enumerate(batch):
+            blob = blobs.get(f"f{i}")
+            if not blob or blob.get("isBinary") or blob.get("isTruncated"):
+                continue
+            if blob.get("text") is None:
+                continue
+            if blob.get("byteSize", 0) > MAX_FILE_SIZE_BYTES:
+                continue
+            results[fp] = blob["text"]
+
+    return results
+
+
 async def fetch_files_content(
     owner: str,
     repo: str,
     branch: str,
     file_paths: list[str],
+    blob_shas: dict[str, str] | None = None,
+    client: httpx.AsyncClient | None = None,
 ) -> dict[str, str]:
     """
     Fetch content for multiple files concurrently.
 
+    Uses batched GraphQL queries when GITHUB_TOKEN is set. Otherwise (or if
+    GraphQL fails) each file is fetched individually: by blob SHA from
+    `blob_shas` when authenticated, else from raw.githubusercontent.com,
+    which doesn't count against the 60 req/hr anonymous rate limit.
+    Uses the shared client unless one is passed in.
+
     Returns a dict mapping file_path → content (only for successfully fetched files).
     """
-    import asyncio
+    client = client or get_client()
 
-    results: dict[str, str] = {}
+    if GITHUB_TOKEN:
+        try:
+            return await fetch_files_graphql(
+                client, owner, repo, branch, file_paths
+            )
+        except GitHubFetchError as exc:
+            logger.warning(
+                "GraphQL file fetch failed (%s) — falling back to REST",
+                exc.message,
+            )
+
+    # At most 10 requests in flight to be polite to GitHub — a new
+    # fetch starts as soon as any one finishes, not per batch
+    semaphore = asyncio.Semaphore(10)
+    shas = blob_shas if GITHUB_TOKEN and blob_shas else {}
+
+    async def bounded_fetch(fp: str) -> tuple[str, str | None]:
+        async with semaphore:
+            sha = shas.get(fp)
+            if sha:
+                return fp, await fetch_blob(client, owner, repo, sha)
+            return fp, await fetch_file_content(client, owner, repo, branch, fp)
 
-    async with httpx.AsyncClient() as client:
-        # Fetch in batches of 10 to be polite to GitHub
-        batch_size = 10
-        for i in range(0, len(file_paths), batch_size):
-            batch = file_paths[i : i + batch_size]
-            tasks = [
-                fetch_file_content(client, owner, repo, branch, fp)
-                for fp in batch
-            ]
-            contents = await asyncio.gather(*tasks)
-            for fp, content in zip(batch, contents):
-                if content is not None:
-                    results[fp] = content
+    results: dict[str, str] = {}
+    tasks = [asyncio.create_task(bounded_fetch(fp)) for fp in file_paths]
+    for future in asyncio.as_completed(tasks):
+        fp, content = await future
+        if content is not None:
+            results[fp] = content
 
     return results
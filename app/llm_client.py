@@ -5,11 +5,16 @@ Uses the OpenAI-compatible SDK to call the Nebius inference endpoint.
 Handles prompt construction, JSON response parsing, and error recovery.
 """
 
+import asyncio
 import json
 import logging
 import re
+import time
+from collections.abc import AsyncIterator
+from typing import Any
 
-from openai import AsyncOpenAI, APIError, APITimeoutError, APIConnectionError
+from openai import NOT_GIVEN, AsyncOpenAI, APIError, APITimeoutError, APIConnectionError
+from pydantic import ValidationError
 
 from app.config import (
     NEBIUS_API_KEY,
@@ -18,10 +23,30 @@ from app.config import (
     LLM_TEMPERATURE,
     LLM_MAX_TOKENS,
     LLM_TIMEOUT,
+    LLM_CONTEXT_WINDOW,
+    LLM_LENIENT_JSON,
+    LLM_STRUCTURED_OUTPUT,
+    LLM_CACHE_TTL,
+    LLM_CACHE_SIZE,
+    LLM_COALESCE_REQUESTS,
 )
+from app.cache import TTLCache, content_key
+from app.models import LLMSummary
+
+try:
+    import orjson
+except ImportError:  # Optional C extension — fall back to the stdlib parser
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch
+# the stdlib exception either way
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# Markdown code fence around the JSON answer, e.g. ```json ... ```
+_FENCE_RE = re.compile(r"```(?:json)?\s*\n?(.*?)\n?\s*```", re.DOTALL)
+
 
 # ── System Prompt ─────────────────────────────────────────────────────
 
@@ -47,13 +72,62 @@ Include only significant dependencies, not every minor utility.
 - Return ONLY the JSON object, nothing else.
 """
 
-# ── User Prompt Template ──────────────────────────────────────────────
+# Constrains decoding to the LLMSummary shape on endpoints that support it.
+# Written out rather than generated from the model, so no titles or
+# docstrings ride along, and limited to keywords strict mode accepts.
+_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "repo_summary",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "summary": {"type": "string"},
+                "technologies": {"type": "array", "items": {"type": "string"}},
+                "structure": {"type": "string"},
+            },
+            "required": ["summary", "technologies", "structure"],
+            "additionalProperties": False,
+        },
+        "strict": True,
+    },
+}
 
-USER_PROMPT_TEMPLATE = """\
-Analyze the following GitHub repository and return a JSON summary.
+# ── User Prompt ───────────────────────────────────────────────────────
 
-{context}
-"""
+# Sent as its own message ahead of the context, so the context string is
+# passed through as-is rather than copied into a template, and the fixed
+# prefix stays identical across requests for provider-side prompt caching
+USER_PROMPT_PREAMBLE = "Analyze the following GitHub repository and return a JSON summary."
+
+
+# Prompt size in tokens, estimated like MAX_CONTEXT_CHARS (1 token ≈ 4 chars)
+_PROMPT_TOKENS = (len(SYSTEM_PROMPT) + len(USER_PROMPT_PREAMBLE)) // 4
+
+# Headroom for the 4-chars-per-token estimate running low (code and
+# non-English text tokenize denser), and the floor we'll ever request
+_TOKEN_SAFETY_MARGIN = 2048
+_MIN_OUTPUT_TOKENS = 1024
+
+
+def _max_tokens_for(context: str) -> int:
+    """
+    Return LLM_MAX_TOKENS clamped to the context window left after the prompt.
+
+    Raises LLMError if fewer than _MIN_OUTPUT_TOKENS would remain — asking
+    for more would overflow the window and fail at the provider anyway.
+    """
+    remaining = (
+        LLM_CONTEXT_WINDOW - _PROMPT_TOKENS - len(context) // 4 - _TOKEN_SAFETY_MARGIN
+    )
+    if remaining < _MIN_OUTPUT_TOKENS:
+        raise LLMError(
+            f"Repository context (~{len(context) // 4} tokens) leaves too little "
+            f"of the model's {LLM_CONTEXT_WINDOW}-token window for a summary. "
+            "Lower MAX_CONTEXT_CHARS.",
+            status_code=500,
+        )
+    return min(LLM_MAX_TOKENS, remaining)
 
 
 # ── LLM Error ─────────────────────────────────────────────────────────
@@ -69,18 +143,60 @@ class LLMError(Exception):
 
 # ── Client ────────────────────────────────────────────────────────────
 
+# One client per process so its connection pool (and TLS sessions to
+# Nebius) is reused across requests instead of rebuilt for each one
+_client: AsyncOpenAI | None = None
+
+
 def _get_client() -> AsyncOpenAI:
-    """Create an AsyncOpenAI client pointed at Nebius Token Factory."""
+    """Return the shared AsyncOpenAI client for Nebius, creating it on first use."""
+    global _client
     if not NEBIUS_API_KEY:
         raise LLMError(
             "NEBIUS_API_KEY environment variable is not set.",
             status_code=500,
         )
-    return AsyncOpenAI(
-        api_key=NEBIUS_API_KEY,
-        base_url=NEBIUS_BASE_URL,
-        timeout=LLM_TIMEOUT,
-    )
+    if _client is None or _client.is_closed():
+        _client = AsyncOpenAI(
+            api_key=NEBIUS_API_KEY,
+            base_url=NEBIUS_BASE_URL,
+            timeout=LLM_TIMEOUT,
+        )
+    return _client
+
+
+# httpx closes pooled connections idle for longer than this (its default)
+_KEEPALIVE_EXPIRY = 5.0
+_WARM_UP_TIMEOUT = 5.0
+
+# Monotonic time the client last completed a request to the API
+_last_used = 0.0
+
+
+async def warm_up() -> None:
+    """
+    Open (or refresh) a pooled connection to the LLM API ahead of a call.
+
+    Best-effort: run it alongside the GitHub fetches so the TLS handshake is
+    done by the time the completion is sent. Skipped if a connection was
+    used recently enough to still be alive. Never raises.
+    """
+    global _last_used
+    if time.monotonic() - _last_used < _KEEPALIVE_EXPIRY:
+        return
+    try:
+        await _get_client().models.list(timeout=_WARM_UP_TIMEOUT)
+        _last_used = time.monotonic()
+    except Exception as exc:  # Missing key, network, API error — the real call reports it
+        logger.debug("LLM warm-up skipped: %s", exc)
+
+
+async def close_client() -> None:
+    """Close the shared LLM client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
 
 
 def _extract_json(text: str) -> dict:
@@ -92,25 +208,28 @@ def _extract_json(text: str) -> dict:
     - Leading/trailing whitespace or text outside the JSON
     - Smart quotes or other unicode substitutions
     """
-    # Strip markdown code fences if present
+    # Strip markdown code fences if present — the substring test keeps the
+    # regex off the common path, where the answer is bare JSON
     text = text.strip()
-    fence_pattern = r"```(?:json)?\s*\n?(.*?)\n?\s*```"
-    match = re.search(fence_pattern, text, re.DOTALL)
-    if match:
-        text = match.group(1).strip()
+    if "```" in text:
+        match = _FENCE_RE.search(text)
+        if match:
+            text = match.group(1).strip()
 
     # Try direct JSON parse first
     try:
-        return json.loads(text)
+        return _json_loads(text)
     except json.JSONDecodeError:
         pass
 
-    # Try to find a JSON object within the text
+    # Try to find a JSON object within the text. The str slice covers only
+    # the braces' span; encoding to bytes for a memoryview slice would copy
+    # the whole (possibly long, reasoning-laden) text instead.
     brace_start = text.find("{")
     brace_end = text.rfind("}")
     if brace_start != -1 and brace_end > brace_start:
         try:
-            return json.loads(text[brace_start : brace_end + 1])
+            return _json_loads(text[brace_start : brace_end + 1])
         except json.JSONDecodeError:
             pass
 
@@ -121,49 +240,54 @@ def _extract_json(text: str) -> dict:
     )
 
 
-def _validate_response(data: dict) -> dict:
+def _load_json(text: str) -> dict:
     """
-    Validate that the parsed JSON has the required fields and types.
+    Parse an answer produced under the JSON schema — bare JSON, no fallbacks.
 
-    Returns a cleaned dict with exactly: summary, technologies, structure.
+    Raises LLMError if the text isn't valid JSON.
     """
-    summary = data.get("summary")
-    technologies = data.get("technologies")
-    structure = data.get("structure")
+    try:
+        return _json_loads(text)
+    except json.JSONDecodeError:
+        raise LLMError(
+            "LLM returned a response that could not be parsed as JSON. "
+            "This is usually transient — please try again.",
+            status_code=502,
+        )
 
-    if not isinstance(summary, str) or not summary.strip():
-        raise LLMError("LLM response is missing a valid 'summary' field.")
-    if not isinstance(technologies, list):
-        raise LLMError("LLM response is missing a valid 'technologies' field.")
-    if not isinstance(structure, str) or not structure.strip():
-        raise LLMError("LLM response is missing a valid 'structure' field.")
 
-    # Ensure all technology entries are strings
-    technologies = [str(t) for t in technologies if t]
+def _validate_response(data: dict) -> dict:
+    """
+    Validate the parsed JSON against LLMSummary.
 
-    return {
-        "summary": summary.strip(),
-        "technologies": technologies,
-        "structure": structure.strip(),
-    }
+    Returns a cleaned dict with exactly: summary, technologies, structure.
+    """
+    try:
+        return LLMSummary.model_validate(data).model_dump()
+    except ValidationError as exc:
+        loc = exc.errors()[0]["loc"]
+        if not loc:
+            raise LLMError("LLM response is not a JSON object.")
+        raise LLMError(f"LLM response is missing a valid '{loc[0]}' field.")
 
 
 # ── Public API ────────────────────────────────────────────────────────
 
+# Validated summaries keyed on content_key(model, prompts, context)
+_SUMMARY_CACHE = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
 
-async def generate_summary(context: str) -> dict:
-    """
-    Send the repository context to the LLM and return a parsed summary.
+# Cache key → task for summaries currently being generated
+_IN_FLIGHT: dict[str, asyncio.Task] = {}
 
-    Args:
-        context: The formatted repository context string from content_filter.
 
-    Returns:
-        A dict with keys: summary, technologies, structure.
+async def _stream_deltas(context: str) -> AsyncIterator[Any]:
+    """
+    Start a streaming chat completion and yield each choice delta.
 
     Raises:
-        LLMError: If the LLM call fails or the response can't be parsed.
+        LLMError: If the LLM is misconfigured or the call fails mid-stream.
     """
+    global _last_used
     if not LLM_MODEL:
         raise LLMError(
             "LLM_MODEL is not configured. Please set a model name in app/config.py.",
@@ -171,22 +295,29 @@ async def generate_summary(context: str) -> dict:
         )
 
     client = _get_client()
-    user_prompt = USER_PROMPT_TEMPLATE.format(context=context)
+    max_tokens = _max_tokens_for(context)
 
-    logger.info(
+    logger.debug(
         "Calling LLM model=%s, context_chars=%d", LLM_MODEL, len(context)
     )
 
     try:
-        response = await client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model=LLM_MODEL,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
+                {"role": "user", "content": USER_PROMPT_PREAMBLE},
+                {"role": "user", "content": context},
             ],
             temperature=LLM_TEMPERATURE,
-            max_tokens=LLM_MAX_TOKENS,
+            max_tokens=max_tokens,
+            response_format=_RESPONSE_FORMAT if LLM_STRUCTURED_OUTPUT else NOT_GIVEN,
+            stream=True,
         )
+        async for chunk in stream:
+            if chunk.choices:
+                yield chunk.choices[0].delta
+        _last_used = time.monotonic()
     except APITimeoutError:
         raise LLMError(
             "LLM request timed out. The repository may be too large, "
@@ -203,33 +334,90 @@ async def generate_summary(context: str) -> dict:
         logger.error("Nebius API error: %s", exc)
         raise LLMError(
             f"Nebius API error: {exc.message}",
-            status_code=exc.status_code or 502,
+            status_code=getattr(exc, "status_code", None) or 502,
         )
 
-    # Extract the response text — handle reasoning models like Kimi-K2.5
-    # where content may be in `content` OR `reasoning_content`
-    choice = response.choices[0] if response.choices else None
-    if not choice or not choice.message:
-        raise LLMError("LLM returned an empty response.")
 
-    raw_text = None
-    msg = choice.message
+def _retrieve_exception(task: asyncio.Task) -> None:
+    """
+    Mark a shared call's failure as seen.
+
+    If every waiter was cancelled, nobody awaits the task, and asyncio
+    would log "Task exception was never retrieved" for it.
+    """
+    if not task.cancelled():
+        task.exception()
+
+
+async def generate_summary(context: str) -> dict:
+    """
+    Send the repository context to the LLM and return a parsed summary.
+
+    The completion is streamed and accumulated, so the answer is assembled
+    while the model is still decoding rather than in one final payload.
+
+    Args:
+        context: The formatted repository context string from content_filter.
+
+    Returns:
+        A dict with keys: summary, technologies, structure.
+
+    Raises:
+        LLMError: If the LLM call fails or the response can't be parsed.
+    """
+    cache_key = content_key(LLM_MODEL, SYSTEM_PROMPT, USER_PROMPT_PREAMBLE, context)
+    cached = _SUMMARY_CACHE.get(cache_key)
+    if cached is not None:
+        logger.debug("LLM cache hit, context_chars=%d", len(context))
+        return cached
+
+    if not LLM_COALESCE_REQUESTS:
+        return await _summarize(context, cache_key)
+
+    # Identical requests arriving while one is in flight wait for its
+    # result instead of issuing their own LLM call
+    task = _IN_FLIGHT.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_summarize(context, cache_key))
+        _IN_FLIGHT[cache_key] = task
+        task.add_done_callback(lambda _: _IN_FLIGHT.pop(cache_key, None))
+        task.add_done_callback(_retrieve_exception)
+    else:
+        logger.debug("Joining in-flight LLM call, context_chars=%d", len(context))
+    # Shielded, so one client disconnecting doesn't cancel the others' call
+    return await asyncio.shield(task)
+
+
+async def _summarize(context: str, cache_key: str) -> dict:
+    """Run the LLM call for `context`, then parse, validate and cache it."""
+    content: list[str] = []
+    reasoning_content: list[str] = []
+    reasoning: list[str] = []
+
+    async for delta in _stream_deltas(context):
+        if delta.content:
+            content.append(delta.content)
+        # Reasoning models like Kimi-K2.5 may stream the answer in
+        # `reasoning_content` (or `reasoning`) instead of `content`
+        if text := getattr(delta, "reasoning_content", None):
+            reasoning_content.append(text)
+        if text := getattr(delta, "reasoning", None):
+            reasoning.append(text)
+
+    raw_text = "".join(content).strip()
 
     # Prefer content (the final answer)
-    if msg.content and msg.content.strip():
-        raw_text = msg.content.strip()
-    # Fallback: reasoning models may put everything in reasoning_content
-    elif hasattr(msg, "reasoning_content") and msg.reasoning_content:
+    if not raw_text and reasoning_content:
         logger.warning(
             "LLM content was empty — extracting from reasoning_content"
         )
-        raw_text = msg.reasoning_content.strip()
+        raw_text = "".join(reasoning_content).strip()
     # Also check the 'reasoning' field (alternative attribute name)
-    elif hasattr(msg, "reasoning") and msg.reasoning:
+    elif not raw_text and reasoning:
         logger.warning(
             "LLM content was empty — extracting from reasoning field"
         )
-        raw_text = msg.reasoning.strip()
+        raw_text = "".join(reasoning).strip()
 
     if not raw_text:
         raise LLMError(
@@ -238,11 +426,11 @@ async def generate_summary(context: str) -> dict:
             status_code=502,
         )
 
-    logger.info("LLM response received, length=%d chars", len(raw_text))
+    logger.debug("LLM response received, length=%d chars", len(raw_text))
 
     # Parse and validate
-    parsed = _extract_json(raw_text)
+    parsed = _extract_json(raw_text) if LLM_LENIENT_JSON else _load_json(raw_text)
     validated = _validate_response(parsed)
 
+    _SUMMARY_CACHE.set(cache_key, validated)
     return validated
-
@@ -11,14 +11,25 @@ Features:
   - Structured logging
 """
 
+import asyncio
 import logging
+import time
+from collections.abc import Callable, Coroutine
 from contextlib import asynccontextmanager
+from typing import Any
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
+from app.cache import TTLCache, content_key
+from app.config import (
+    CORS_ORIGINS,
+    LLM_MODEL,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+)
 from app.models import (
     SummarizeRequest,
     SummarizeResponse,
@@ -29,10 +40,16 @@ from app.github_fetcher import (
     parse_github_url,
     fetch_repo_data,
     fetch_files_content,
+    close_client as close_github_client,
     GitHubFetchError,
 )
-from app.content_filter import select_files, build_context
-from app.llm_client import generate_summary, LLMError
+from app.content_filter import process_tree, build_context
+from app.llm_client import (
+    generate_summary,
+    warm_up as warm_up_llm,
+    close_client as close_llm_client,
+    LLMError,
+)
 
 
 # ── Logging ───────────────────────────────────────────────────────────
@@ -44,6 +61,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger("app")
 
+# Per-request HTTP logs from the clients would drown out our own
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("openai").setLevel(logging.WARNING)
+
 
 # ── Lifespan ──────────────────────────────────────────────────────────
 
@@ -53,6 +74,8 @@ async def lifespan(app: FastAPI):
     logger.info("🚀 GitHub Repo Summarizer API starting up")
     yield
     logger.info("👋 Shutting down")
+    await close_github_client()
+    await close_llm_client()
 
 
 # ── App Instance ──────────────────────────────────────────────────────
@@ -67,78 +90,124 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# CORS — allow all origins by default for easy frontend integration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# CORS — allow all origins by default for easy frontend integration.
+# Credentials are only allowed for an explicit origin list: a wildcard
+# with credentials is rejected by browsers and makes Starlette echo each
+# request's Origin back.
+def _cors_options(origins: list[str]) -> dict[str, Any]:
+    """CORSMiddleware options for `origins`; credentials only for explicit ones."""
+    return {
+        "allow_origins": origins,
+        "allow_credentials": "*" not in origins,
+        "allow_methods": ["*"],
+        "allow_headers": ["*"],
+    }
+
+
+if CORS_ORIGINS:
+    app.add_middleware(CORSMiddleware, **_cors_options(CORS_ORIGINS))
 
 
 # ── Error Handlers ────────────────────────────────────────────────────
+# Each handler maps an exception to (status_code, message); one dispatcher
+# renders them all in the ErrorResponse shape.
 
 
-@app.exception_handler(GitHubFetchError)
-async def github_error_handler(request: Request, exc: GitHubFetchError):
-    """Handle GitHub API errors with consistent error shape."""
+def _github_error(exc: GitHubFetchError) -> tuple[int, str]:
+    """GitHub API errors keep their mapped status code."""
     logger.warning("GitHub error: %s (status=%d)", exc.message, exc.status_code)
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=ErrorResponse(message=exc.message).model_dump(),
-    )
+    return exc.status_code, exc.message
 
 
-@app.exception_handler(LLMError)
-async def llm_error_handler(request: Request, exc: LLMError):
-    """Handle LLM errors with consistent error shape."""
+def _llm_error(exc: LLMError) -> tuple[int, str]:
+    """LLM errors keep their mapped status code."""
     logger.error("LLM error: %s (status=%d)", exc.message, exc.status_code)
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=ErrorResponse(message=exc.message).model_dump(),
-    )
+    return exc.status_code, exc.message
 
 
-@app.exception_handler(RequestValidationError)
-async def validation_error_handler(request: Request, exc: RequestValidationError):
-    """Handle request validation errors with consistent error shape."""
+def _validation_error(exc: RequestValidationError) -> tuple[int, str]:
+    """Request validation errors, flattened into one message."""
     messages = "; ".join(
         f"{'.'.join(str(loc) for loc in e['loc'])}: {e['msg']}"
         for e in exc.errors()
     )
-    return JSONResponse(
-        status_code=422,
-        content=ErrorResponse(message=f"Validation error: {messages}").model_dump(),
-    )
+    return 422, f"Validation error: {messages}"
 
 
-@app.exception_handler(HTTPException)
-async def http_error_handler(request: Request, exc: HTTPException):
-    """Wrap FastAPI HTTPExceptions in our consistent error shape."""
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=ErrorResponse(message=str(exc.detail)).model_dump(),
-    )
+def _http_error(exc: HTTPException) -> tuple[int, str]:
+    """FastAPI HTTPExceptions, with their detail as the message."""
+    return exc.status_code, str(exc.detail)
 
 
-@app.exception_handler(Exception)
-async def generic_error_handler(request: Request, exc: Exception):
+def _unexpected_error(exc: Exception) -> tuple[int, str]:
     """Catch-all for unexpected errors."""
     logger.exception("Unhandled error: %s", exc)
-    return JSONResponse(
-        status_code=500,
-        content=ErrorResponse(
-            message="An unexpected error occurred. Please try again."
-        ).model_dump(),
-    )
+    return 500, "An unexpected error occurred. Please try again."
+
+
+_HANDLERS: dict[type[Exception], Callable[[Any], tuple[int, str]]] = {
+    GitHubFetchError: _github_error,
+    LLMError: _llm_error,
+    RequestValidationError: _validation_error,
+    HTTPException: _http_error,
+    Exception: _unexpected_error,
+}
+
+
+async def error_handler(request: Request, exc: Exception) -> JSONResponse:
+    """Render any handled exception with the consistent error shape."""
+    # Most specific registered class wins; Exception always matches last
+    handler = next(_HANDLERS[cls] for cls in type(exc).__mro__ if cls in _HANDLERS)
+    status_code, message = handler(exc)
+    return JSONResponse(status_code=status_code, content=_err(message))
+
+
+def _err(message: str) -> dict:
+    """
+    Build an ErrorResponse body without a Pydantic round-trip.
+
+    ErrorResponse stays the documented schema (see `responses=` below);
+    its shape is fixed, so validating it per error buys nothing.
+    """
+    return {"status": "error", "message": message}
+
+
+for _exc_class in _HANDLERS:
+    app.add_exception_handler(_exc_class, error_handler)
+
+
+# ── Response Cache ────────────────────────────────────────────────────
+
+# LLM results keyed on content_key(model, owner, repo, tree SHA). The tree
+# SHA only changes when the repo's files do, so stars/description edits
+# (which do change the LLM context) still reuse the earlier summary.
+_RESPONSE_CACHE = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+
+# ── Background Tasks ──────────────────────────────────────────────────
+
+# Fire-and-forget tasks; the event loop only holds weak references to
+# tasks, so keep each one here until it finishes.
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+
+def _start_background(coro: Coroutine[Any, Any, Any]) -> None:
+    """Run `coro` as a task nobody awaits, without letting it be collected."""
+    task = asyncio.create_task(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
 
 
 # ── Endpoints ─────────────────────────────────────────────────────────
 
+# Endpoints declare a response model / return type: FastAPI then serializes
+# straight to JSON bytes through Pydantic's core, skipping json.dumps.
+# (A custom default_response_class such as ORJSONResponse would disable
+# that fast path — and is deprecated in current FastAPI.)
+
 
 @app.get("/health")
-async def health_check():
+async def health_check() -> dict[str, str]:
     """Simple health check for frontend connectivity testing."""
     return {"status": "ok"}
 
@@ -168,12 +237,13 @@ async def summarize_repo(body: SummarizeRequest):
       6. Return structured response with repo metadata
     """
     # Step 1: Parse URL
+    started = time.perf_counter()
     owner, repo = parse_github_url(body.github_url)
-    logger.info("Summarizing %s/%s", owner, repo)
+    logger.debug("Summarizing %s/%s", owner, repo)
 
     # Step 2: Fetch repo metadata and file tree
     metadata, tree = await fetch_repo_data(owner, repo)
-    logger.info(
+    logger.debug(
         "Fetched metadata and tree: %d entries, branch=%s",
         len(tree),
         metadata["default_branch"],
@@ -186,28 +256,70 @@ async def summarize_repo(body: SummarizeRequest):
             status_code=422,
         )
 
-    # Step 3: Filter and prioritise files
-    selected = select_files(tree)
+    # Unchanged tree → skip straight to the response with fresh metadata
+    tree_sha = metadata.get("tree_sha")
+    cache_key = (
+        content_key(LLM_MODEL, owner.lower(), repo.lower(), tree_sha)
+        if tree_sha
+        else None
+    )
+    cached = _RESPONSE_CACHE.get(cache_key) if cache_key else None
+    if cached is not None:
+        logger.info(
+            "Summarized %s/%s from cache (tree %s) in %.2fs",
+            owner,
+            repo,
+            tree_sha[:7],
+            time.perf_counter() - started,
+        )
+        return _build_response(cached, metadata)
+
+    # Step 3: Filter and prioritise files (and format the tree view)
+    tree_str, selected = process_tree(tree)
     file_paths = [f["path"] for f in selected]
-    logger.info(
+    blob_shas = {f["path"]: f["sha"] for f in selected if f["sha"]}
+    logger.debug(
         "Selected %d files for context (from %d total tree entries)",
         len(selected),
         len(tree),
     )
 
-    # Step 4: Fetch file contents
+    # Step 4: Fetch file contents, warming up the LLM connection meanwhile
+    # (never awaited: if the files arrive first, the LLM call must not wait on it)
+    _start_background(warm_up_llm())
     file_contents = await fetch_files_content(
-        owner, repo, metadata["default_branch"], file_paths
+        owner, repo, metadata["default_branch"], file_paths, blob_shas=blob_shas
     )
-    logger.info("Fetched content for %d files", len(file_contents))
+    logger.debug("Fetched content for %d files", len(file_contents))
 
     # Step 5: Build context and call LLM
-    context = build_context(metadata, tree, file_contents, selected)
-    logger.info("Built context: %d chars", len(context))
+    context = build_context(
+        metadata, tree, file_contents, selected, tree_str=tree_str
+    )
+    logger.debug("Built context: %d chars", len(context))
 
     llm_result = await generate_summary(context)
+    # A summary of a partial fetch (timeouts, rate limiting) would otherwise
+    # be served for every later request against this tree
+    if cache_key and len(file_contents) == len(file_paths):
+        _RESPONSE_CACHE.set(cache_key, llm_result)
+
+    logger.info(
+        "Summarized %s/%s: %d/%d files, %d context chars in %.2fs",
+        owner,
+        repo,
+        len(file_contents),
+        len(selected),
+        len(context),
+        time.perf_counter() - started,
+    )
 
     # Step 6: Build response with repo metadata
+    return _build_response(llm_result, metadata)
+
+
+def _build_response(llm_result: dict, metadata: dict) -> SummarizeResponse:
+    """Combine the LLM summary with the repository metadata for display."""
     repo_metadata = RepoMetadata(
         name=metadata["name"],
         owner=metadata["owner"],
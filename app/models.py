@@ -7,12 +7,17 @@ Designed for easy frontend integration:
 - ErrorResponse uses a consistent shape across all failure modes.
 """
 
-from pydantic import BaseModel, Field, field_validator
+from typing import Annotated
+
+from pydantic import BaseModel, Field, StringConstraints, field_validator
 import re
 
 
 # ── Request ───────────────────────────────────────────────────────────
 
+_GITHUB_URL_RE = re.compile(r"^https?://github\.com/[\w.\-]+/[\w.\-]+/?$")
+
+
 class SummarizeRequest(BaseModel):
     """POST /summarize request body."""
 
@@ -26,13 +31,13 @@ class SummarizeRequest(BaseModel):
     @classmethod
     def validate_github_url(cls, v: str) -> str:
         """Ensure the URL looks like a valid GitHub repository URL."""
-        pattern = r"^https?://github\.com/[\w.\-]+/[\w.\-]+/?$"
-        if not re.match(pattern, v.strip()):
+        url = v.strip()
+        if not _GITHUB_URL_RE.match(url):
             raise ValueError(
                 "Invalid GitHub repository URL. "
                 "Expected format: https://github.com/{owner}/{repo}"
             )
-        return v.strip().rstrip("/")
+        return url.rstrip("/")
 
 
 # ── Response ──────────────────────────────────────────────────────────
@@ -69,6 +74,34 @@ class SummarizeResponse(BaseModel):
     )
 
 
+# ── LLM Output ────────────────────────────────────────────────────────
+
+NonEmptyStr = Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
+
+
+class LLMSummary(BaseModel):
+    """
+    The structured answer requested from the LLM.
+
+    The parsed answer is validated against it; llm_client mirrors its
+    fields in the response_format schema sent to the provider.
+    """
+
+    summary: NonEmptyStr
+    technologies: list[str]
+    structure: NonEmptyStr
+
+    @field_validator("technologies", mode="before")
+    @classmethod
+    def drop_empty_technologies(cls, v):
+        """Coerce entries to stripped strings, dropping empty and repeated ones."""
+        if not isinstance(v, list):
+            return v
+        # Entries are nearly always strings already; only the rest need str()
+        names = (t if isinstance(t, str) else str(t) for t in v if t)
+        return list(dict.fromkeys(name for name in map(str.strip, names) if name))
+
+
 # ── Error ─────────────────────────────────────────────────────────────
 
 class ErrorResponse(BaseModel):
@@ -0,0 +1,40 @@
+"""Shared pytest fixtures for the API test suite."""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The FastAPI application under test."""
+    return main.app
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    """One TestClient (and one app lifespan) shared by every endpoint test."""
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def run_with_transport():
+    """
+    Return run(handler, coro_fn): await coro_fn(client) on an AsyncClient whose
+    requests are answered by `handler` (an httpx.MockTransport), and return
+    its result. The client is closed afterwards.
+    """
+    def run(handler, coro_fn):
+        async def main():
+            transport = httpx.MockTransport(handler)
+            async with httpx.AsyncClient(transport=transport) as client:
+                return await coro_fn(client)
+
+        return asyncio.run(main())
+
+    return run